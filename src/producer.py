@@ -3,16 +3,18 @@ Last modified: 21 Oct, 2020
 Author: Arthur Jinyue Guo jg5505@nyu.edu
 """
 import os
-import sox
+import tempfile
+import subprocess
+import concurrent.futures
 import attr
-import json
+import mido
 import soundfile as sf
 import numpy as np
-import music21 as m2
 import singer_a
 import singer_b
 import singer_c
 import song
+from utils import load_json
 
 @attr.s()
 class Producer(object):
@@ -27,10 +29,10 @@ class Producer(object):
     # init functions
     #
     def __attrs_post_init__(self):
-        with open(self.leadsheet_path, "r") as f:
-            f_json = json.load(f)
-            supported_genres = f_json["supported_genres"]
-        
+        f_json = load_json(self.leadsheet_path)
+        supported_genres = f_json["supported_genres"]
+
+
         if self.genre_name not in supported_genres:
             raise ValueError(f"Unsupported genre: {self.genre_name}")
 
@@ -82,31 +84,47 @@ class Producer(object):
         reverb: int 0 or 1
             binary boolean controlling the reverb switch. CAN NOT BE FLOAT!
         """
-        stream = os.popen(f"fluidsynth {soundfont_path} {midi_path} -F {audio_path} -g {gain} --chorus {chorus} --reverb {reverb} -o synth.min-note-length=1000")
-        output = stream.read()
+        argv = ["fluidsynth", soundfont_path, midi_path, "-F", audio_path,
+                "-g", str(gain), "--chorus", str(chorus), "--reverb", str(reverb),
+                "-o", "synth.min-note-length=1000"]
         if verbose:
-            print(output)
+            # stream the log as it arrives instead of buffering the whole render.
+            proc = subprocess.Popen(argv, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, bufsize=1, text=True)
+            for line in proc.stdout:
+                print(line, end="")
+            proc.wait()
+        else:
+            # discard fluidsynth's progress output at the kernel, no buffering.
+            subprocess.run(argv, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
 
     @staticmethod
     def merge_midi(midi_in_1_path: str, midi_in_2_path: str, midi_out_path: str):
         """
-        merge two midi files.
+        merge two midi files by concatenating their tracks with mido.
 
-        does not work with mma-generated midi files. instruments and quantization has some error.
-        works well with music21 outputs.
+        mido copies the events as raw bytes, so mma-generated files keep
+        their instruments and quantization (the old music21-based merge
+        re-analyzed and re-quantized everything).
         """
+        midi_1 = mido.MidiFile(midi_in_1_path)
+        midi_2 = mido.MidiFile(midi_in_2_path)
 
-        s1 = m2.converter.parse(midi_in_1_path, format="midi", quantizePost=False)
-        s2 = m2.converter.parse(midi_in_2_path, format="midi", quantizePost=False)
-        s1.mergeElements(s2)
-        print(s1.elements[1].elements)
-        # s1.write("midi", midi_out_path)
-        # print(f"midi file written at {midi_out_path}")
+        merged = mido.MidiFile(type=1, ticks_per_beat=midi_1.ticks_per_beat)
+        merged.tracks.extend(midi_1.tracks)
+        # rescale delta times if the two files use a different resolution.
+        scale = midi_1.ticks_per_beat / midi_2.ticks_per_beat
+        for track in midi_2.tracks:
+            if scale != 1:
+                track = mido.MidiTrack(msg.copy(time=int(round(msg.time * scale))) for msg in track)
+            merged.tracks.append(track)
+
+        merged.save(midi_out_path)
+        print(f"midi file written at {midi_out_path}")
 
     @staticmethod
     def merge_audio(audio_in_1_path: str, audio_in_2_path: str, mix: float, audio_out_path: str):
         """
-        merge two audio files using pysox.
+        merge two audio files by linear mixing in memory.
         does not support .oga file.
 
         Parameters
@@ -114,10 +132,27 @@ class Producer(object):
         mix : float
             volume ratio of audio_in_1.
         """
-
-        comb = sox.combine.Combiner()
-        comb.set_input_format(file_type=["wav", "wav"])
-        comb.build([audio_in_1_path, audio_in_2_path], audio_out_path, "mix", [mix, 1-mix])
+        audio_1, sample_rate = sf.read(audio_in_1_path, dtype="float32")
+        audio_2, _ = sf.read(audio_in_2_path, dtype="float32")
+
+        # pad the shorter file with silence so both cover the same span.
+        num_frames = max(len(audio_1), len(audio_2))
+        pad_widths = lambda a: [(0, num_frames-len(a))] + [(0, 0)]*(a.ndim-1)
+        if len(audio_1) < num_frames:
+            audio_1 = np.pad(audio_1, pad_widths(audio_1))
+        if len(audio_2) < num_frames:
+            audio_2 = np.pad(audio_2, pad_widths(audio_2))
+
+        # lift a mono input to the other file's channel count; the sox
+        # mixer this replaced accepted mixed channel layouts.
+        if audio_1.ndim < audio_2.ndim:
+            audio_1 = np.repeat(audio_1[:, None], audio_2.shape[1], axis=1)
+        elif audio_2.ndim < audio_1.ndim:
+            audio_2 = np.repeat(audio_2[:, None], audio_1.shape[1], axis=1)
+        if audio_1.shape != audio_2.shape:
+            raise ValueError(f"Channel count mismatch: {audio_1.shape[1]} vs {audio_2.shape[1]}")
+
+        sf.write(audio_out_path, mix*audio_1 + (1-mix)*audio_2, sample_rate, subtype="PCM_16")
 
     #
     # class methods
@@ -135,15 +170,26 @@ class Producer(object):
         """
         chord_prog = ""
         pattern_prog = []
-
-        chord_prog += np.random.choice(chord_progressions["Intro"])
-        pattern_prog.append(len(chord_prog.split("\n")))
-        chord_prog += np.random.choice(chord_progressions["Main1"])
-        pattern_prog.append(len(chord_prog.split("\n")))
-        chord_prog += np.random.choice(chord_progressions["Fill"])
-        pattern_prog.append(len(chord_prog.split("\n")))
-        chord_prog += np.random.choice(chord_progressions["Main2"])
-        pattern_prog.append(len(chord_prog.split("\n")))
+        # track the line count as we go instead of re-splitting the whole
+        # accumulated progression after every section.
+        num_lines = 1
+
+        segment = np.random.choice(chord_progressions["Intro"])
+        chord_prog += segment
+        num_lines += segment.count("\n")
+        pattern_prog.append(num_lines)
+        segment = np.random.choice(chord_progressions["Main1"])
+        chord_prog += segment
+        num_lines += segment.count("\n")
+        pattern_prog.append(num_lines)
+        segment = np.random.choice(chord_progressions["Fill"])
+        chord_prog += segment
+        num_lines += segment.count("\n")
+        pattern_prog.append(num_lines)
+        segment = np.random.choice(chord_progressions["Main2"])
+        chord_prog += segment
+        num_lines += segment.count("\n")
+        pattern_prog.append(num_lines)
         chord_prog += np.random.choice(chord_progressions["Outro"])
 
         return chord_prog, pattern_prog
@@ -154,39 +200,34 @@ class Producer(object):
         """
         return np.random.randint(tempo_range[0], tempo_range[1])
 
-    def build(self, mix=0.5, output_path="../producer_output.wav", remove_temp=True):
+    def build(self, mix=0.5, output_path="../producer_output.wav"):
         """
         build the final output .wav file.
 
-        Parameters
-        ----------
-        remove_temp : boolean
-            whether to remove all the temp files.
+        all the intermediate mma/midi/wav files live in a temporary
+        directory that is removed when the build finishes.
         """
-        try:
-            os.mkdir("../temp/")
-        except:
-            pass
-
-        self.song.build("../temp/output.mma") # generates the accompany midi file
-        self.singer.sing() 
-        self.singer.export_midi("../temp/singer_output.mid") # generates the melody midi file
-        Producer.render_audio(soundfont_path="../downloads/Orpheus_18.06.2020.sf2", midi_path="../temp/output.mid", audio_path="../temp/output.wav", verbose=True)
-        Producer.render_audio(soundfont_path="../downloads/Orpheus_18.06.2020.sf2", midi_path="../temp/singer_output.mid", audio_path="../temp/singer_output.wav", verbose=True)
-        Producer.merge_audio("../temp/output.wav", "../temp/singer_output.wav", mix=mix, audio_out_path=output_path)
+        with tempfile.TemporaryDirectory() as temp_dir:
+            accomp_midi = self.song.build(os.path.join(temp_dir, "output.mma")) # generates the accompany midi file
+            self.singer.sing()
+            singer_midi = os.path.join(temp_dir, "singer_output.mid")
+            self.singer.export_midi(singer_midi) # generates the melody midi file
+
+            accomp_wav = os.path.join(temp_dir, "output.wav")
+            singer_wav = os.path.join(temp_dir, "singer_output.wav")
+            # the two renders are independent fluidsynth processes, so run them in parallel.
+            with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+                renders = [executor.submit(Producer.render_audio, soundfont_path="../downloads/Orpheus_18.06.2020.sf2", midi_path=accomp_midi, audio_path=accomp_wav, verbose=True),
+                           executor.submit(Producer.render_audio, soundfont_path="../downloads/Orpheus_18.06.2020.sf2", midi_path=singer_midi, audio_path=singer_wav, verbose=True)]
+                for render in renders:
+                    render.result()
+            Producer.merge_audio(accomp_wav, singer_wav, mix=mix, audio_out_path=output_path)
 
         print(f"audio file exported at {output_path}")
 
-        if remove_temp:
-            os.remove("../temp/output.mid")
-            os.remove("../temp/output.wav")
-            os.remove("../temp/singer_output.mid")
-            os.remove("../temp/singer_output.wav")
-            os.rmdir("../temp")
-
 
 if __name__ == "__main__":
     my_producer = Producer(key="D", genre_name="spiritual")
-    my_producer.build(mix=0.5, remove_temp=False)
+    my_producer.build(mix=0.5)
     stream = os.popen(f"ffmpeg -y -hide_banner -loglevel warning -i ../producer_output.wav -vn -ar 44100 -ac 2 -b:a 128k ../producer_output.mp3")
     output = stream.read()
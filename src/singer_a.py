@@ -22,24 +22,32 @@ class SingerA(SingerBase):
         a singer who only sings the chord pitches. fills self.melody.
         basically same as a random arppegiator.
         """
-        speed = np.random.choice(self.inst_settings["speed"])
-        for current_chord in self.chords.elements[1:]:
-            chord_tones = [pitch.name for pitch in current_chord.pitches]
-            singable_pitches = []
-            for pitch in self.possible_pitches:
-                if pitch.name in chord_tones:
-                    singable_pitches.append(pitch.nameWithOctave)
+        speed = self._rng.choice(self._speed_choices)
+        rand_vol = self._rand_vol
+        # one shared Duration for the whole call; notes never mutate it.
+        dur = m2.duration.Duration(4/speed)
+        # buffer the notes and append them to the stream in one call, so
+        # music21 only recomputes offsets once.
+        notes_buf = []
+        for chord_index in range(self.num_measures):
+            singable_pitches = self._singable_names_by_chord[chord_index]
 
-            for i in range(int(speed*int(self.time_signature[0])/4)):
-                if np.random.rand() < self.inst_settings["rand_trig"]:
+            # draw all random numbers for this chord in one batch.
+            num_steps = (speed * self._beats_per_measure) // 4
+            trig = self._rng.random(num_steps)
+            vol_delta = self._rng.integers(-rand_vol, rand_vol+1, num_steps)
+            pitch_idx = self._rng.integers(0, len(singable_pitches), num_steps)
+            for i in range(num_steps):
+                if trig[i] < self._rand_trig:
                     n = m2.note.Rest()
                 else:
-                    current_pitch = np.random.choice(singable_pitches)
-                    n = m2.note.Note(current_pitch)
-                    n.volume = m2.volume.Volume(velocity=self.default_volume+int(self.inst_settings["rand_vol"]*(2*np.random.rand()-1)))
-                n.duration = m2.duration.Duration(4/speed)
+                    n = m2.note.Note(singable_pitches[pitch_idx[i]])
+                    n.volume.velocity = self.default_volume+int(vol_delta[i])
+                n.duration = dur
 
-                self.melody.append(n)
+                notes_buf.append(n)
+
+        self.melody.append(notes_buf)
 
 if __name__ == "__main__":
     my_singer = SingerA(tempo=110, key="D", time_signature="4/4", 
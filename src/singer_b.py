@@ -8,7 +8,7 @@ import json
 import numpy as np
 import music21 as m2
 
-from singer_base import SingerBase, MusicTheoryError
+from singer_base import SingerBase, MusicTheoryError, _generate_steps
 
 @attr.s()
 class SingerB(SingerBase):
@@ -19,81 +19,65 @@ class SingerB(SingerBase):
     Parameters
     ----------
     prob_factor : float
-        Parameter of SingerB._interval_reversed_p().
+        Parameter of the interval weighting in singer_base._generate_steps().
         the index of reverse probability. if bigger, the closer note will have higher probability.
     prob_offset : float
-        Parameter of SingerB._interval_reversed_p().
+        Parameter of the interval weighting in singer_base._generate_steps().
         offset when calculating inversed probability.
     """
     prob_factor = attr.ib(type=float, default=2)
     prob_offset = attr.ib(type=float, default=5)
 
+    @prob_offset.validator
+    def check_prob_offset(self, attribute, value):
+        if value <= 0:
+            raise ValueError(f"Invalid prob_offset: {value}, must be positive.")
+
     # override SingerBase.sing()
     def sing(self):
         """
         Sing according to interval with the previous note. closer note will have higher probability.
         """
-        speed = np.random.choice(self.inst_settings["speed"])
-        for current_chord in self.chords.elements[1:]:
-            chord_tones = [pitch.name for pitch in current_chord.pitches]
-            singable_pitches = []
-            for pitch in self.possible_pitches:
-                if pitch.name in chord_tones:
-                    singable_pitches.append(pitch.nameWithOctave)
+        speed = self._rng.choice(self._speed_choices)
+        rand_vol = self._rand_vol
+        # one shared Duration for the whole call; notes never mutate it.
+        dur = m2.duration.Duration(4/speed)
+        # buffer the notes and append them to the stream in one call, so
+        # music21 only recomputes offsets once.
+        notes_buf = []
+        last_midi = -1
+        for chord_index, current_chord in enumerate(self._chord_objs[1:]):
+            singable_pitches = self._singable_names_by_chord[chord_index]
+            singable_midi = self.possible_midi[self._singable_by_chord_idx[chord_index]]
 
-            if singable_pitches is None:
+            # the name lists are built as (possibly empty) lists, never None,
+            # so test emptiness; an empty chord otherwise surfaced later as
+            # an opaque indexing error.
+            if not singable_pitches:
                 raise MusicTheoryError(f"No singable pitches! chord: {current_chord}, key: {self.key}")
 
-            for i in range(int(speed * int(self.time_signature[0])/4)):
-                if np.random.rand() < self.inst_settings["rand_trig"]:
+            # all the numeric work for this chord runs in the array kernel;
+            # the loop below only builds music21 objects.
+            num_steps = (speed * self._beats_per_measure) // 4
+            u_trig = self._rng.random(num_steps)
+            u_pick = self._rng.random(num_steps)
+            vol_delta = self._rng.integers(-rand_vol, rand_vol+1, num_steps)
+            pick_idx = _generate_steps(singable_midi, num_steps,
+                                       self._rand_trig,
+                                       float(self.prob_factor), float(self.prob_offset),
+                                       last_midi, u_trig, u_pick)
+            for i in range(num_steps):
+                if pick_idx[i] < 0:
                     n = m2.note.Rest()
                 else:
-                    if len(self.melody.notes) == 0:
-                        current_pitch = np.random.choice(singable_pitches)
-                    else:
-                        interval_p = self._interval_reversed_p(self.melody.notes[-1].pitch, 
-                                                              singable_pitches,
-                                                              self.prob_factor,
-                                                              self.prob_offset)
-                        try:
-                            current_pitch = np.random.choice(singable_pitches, p=interval_p)
-                        except:
-                            raise MusicTheoryError(f"Random choice failed! chord: {current_chord}, key: {self.key}")
-                    n = m2.note.Note(current_pitch)
-                    n.volume = m2.volume.Volume(velocity=self.default_volume+int(self.inst_settings["rand_vol"]*(2*np.random.rand()-1)))
-                n.duration = m2.duration.Duration(4/speed)
-
-                self.melody.append(n)
+                    n = m2.note.Note(singable_pitches[pick_idx[i]])
+                    n.volume.velocity = self.default_volume+int(vol_delta[i])
+                    last_midi = int(singable_midi[pick_idx[i]])
+                n.duration = dur
 
-    #
-    # util funcs
-    #
-    def _interval_reversed_p(self, target_pitch, pitch_list, prob_factor=2, prob_offset=5)->list:
-        """
-        calculate the interval of the pitch to each element in the pitch list.
-        returns a normalized probability of each note, closer note has higher probability.
+                notes_buf.append(n)
 
-        Parameters
-        ----------
-        target_pitch : music21.interval.Interval 
-            the targe pitch to calcualte interval with
-        pitch_list : list of str
-            each string is a pitch name, e.g. "G4"
-        prob_factor : float
-            the index of reverse probability. if bigger, the closer note will have higher probability.
-        prob_offset : float
-            offset when calculating inversed probability.
-
-        Returns
-        -------
-        interval_p : list of float
-            the normalized probability of each note.
-        """
-        interval_to_rf = np.array([np.abs(m2.interval.Interval(target_pitch, m2.pitch.Pitch(p)).semitones) for p in pitch_list])
-        interval_p = 1 / (interval_to_rf + prob_offset)
-        interval_p = interval_p ** prob_factor
-        interval_p = interval_p / np.sum(interval_p)
-        return interval_p
+        self.melody.append(notes_buf)
 
 
 if __name__ == "__main__":
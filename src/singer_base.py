@@ -4,10 +4,91 @@ Author: Arthur Jinyue Guo jg5505@nyu.edu
 """
 import os
 import attr
-import json
+import copy
+import functools
 import numpy as np
 import music21 as m2
 
+from utils import load_json
+
+try:
+    from numba import njit
+except ImportError:  # numba is optional; without it the kernels run as plain Python.
+    def njit(*args, **kwargs):
+        if args and callable(args[0]):
+            return args[0]
+        def decorator(func):
+            return func
+        return decorator
+
+
+@njit(cache=True)
+def _generate_steps(candidate_midi, num_steps, rand_trig, prob_factor, prob_offset, start_midi, u_trig, u_pick):
+    """
+    Pure-array kernel of the interval-weighted note generator.
+    Keeps all the RNG/distance/probability math out of the interpreter;
+    music21 object construction stays in the caller.
+
+    Parameters
+    ----------
+    candidate_midi : np.ndarray of int16
+        MIDI numbers of the singable pitches for the current chord.
+    num_steps : int
+        number of notes to generate.
+    rand_trig : float
+        probability of a step being a rest.
+    prob_factor, prob_offset : float
+        exponent and offset of the inverse-interval weighting,
+        (1/(|interval|+prob_offset))**prob_factor.
+    start_midi : int
+        MIDI number of the previous melody note, or -1 if there is none
+        (the first pick is then uniform).
+    u_trig, u_pick : np.ndarray of float
+        pre-drawn uniforms, one of each per step.
+
+    Returns
+    -------
+    pick_idx : np.ndarray of int16
+        per step, an index into candidate_midi, or -1 for a rest.
+    """
+    pick_idx = np.empty(num_steps, dtype=np.int16)
+    last_midi = start_midi
+    for i in range(num_steps):
+        if u_trig[i] < rand_trig:
+            pick_idx[i] = -1
+            continue
+        if last_midi < 0:
+            idx = int(u_pick[i] * len(candidate_midi))
+        else:
+            w = (1.0 / (np.abs(candidate_midi - last_midi) + prob_offset)) ** prob_factor
+            cdf = np.cumsum(w)
+            idx = np.searchsorted(cdf, u_pick[i] * cdf[-1])
+        pick_idx[i] = idx
+        last_midi = candidate_midi[idx]
+    return pick_idx
+
+
+@functools.lru_cache(maxsize=64)
+def _chord_symbol_template(figure):
+    """
+    Parsed ChordSymbol per chord figure. ChordSymbol parsing is one of
+    music21's slowest constructors and progressions repeat the same few
+    symbols, so parse each once and hand out cheap shallow copies.
+    """
+    c = m2.harmony.ChordSymbol(figure, duration=4)
+    c.volume = m2.volume.Volume(velocity=70)
+    return c
+
+
+@functools.lru_cache(maxsize=64)
+def _scale_pitches(key, low, high):
+    """
+    All pitches of a key within a sound range. Cached so that batches of
+    Singers with the same key and instrument skip the music21 scale walk.
+    """
+    return m2.key.Key(key).getScale().getPitches(low, high)
+
+
 @attr.s()
 class SingerBase(object):
     """
@@ -21,8 +102,10 @@ class SingerBase(object):
         key signature in music21 format.
     chord_progression : str
         e.g. "D\nBm\nG\nA7\nD\nBm\nG\nA7\nD\n", "D\nBm\nG\nA7\n"
-    pattern_prograssion: str
-        currently not used
+    pattern_progression: list
+        the measures to switch sections at. optional; currently only
+        SingerC.sing() uses it, so it defaults to empty and is only
+        validated when given.
     instrument : str
         must be in instruments.json/"supported_instruments"
         the instrument to use when generating midi file. Names are defined in General Midi protocol.
@@ -52,7 +135,7 @@ class SingerBase(object):
     """
     tempo = attr.ib(type=int)
     chord_progression = attr.ib(type=str)
-    pattern_progression = attr.ib(type=list)
+    pattern_progression = attr.ib(type=list, default=())
     instrument = attr.ib(type=str, default="Violin")
     key = attr.ib(type=str, default="C")
     time_signature = attr.ib(type=str, default="4/4")
@@ -69,16 +152,29 @@ class SingerBase(object):
     # init functions 
     #
     def __attrs_post_init__(self):
+        # persistent random generator, shared by all sing() implementations.
+        self._rng = np.random.default_rng()
+
         # load instrument config file
-        with open(self.instrument_path, "r") as f:
-            f_json = json.load(f)
-            supported_instruments = f_json["supported_instruments"]
-            instruments = f_json["instruments"]
-    
+        f_json = load_json(self.instrument_path)
+        supported_instruments = f_json["supported_instruments"]
+        instruments = f_json["instruments"]
+
         if self.instrument not in supported_instruments:
             raise ValueError(f"Unsupported instrument: {self.instrument}")
 
         self.inst_settings = instruments[self.instrument]
+        # speed options as an ndarray, so each sing() draw skips the
+        # list-to-array conversion inside Generator.choice.
+        self._speed_choices = np.asarray(self.inst_settings["speed"])
+        # scalar generator settings, pulled out of the dict once so the
+        # note loops read locals/attributes instead of hashing dict keys.
+        self._rand_trig = float(self.inst_settings["rand_trig"])
+        self._rand_vol = int(self.inst_settings["rand_vol"])
+
+        # beats per measure, parsed once. splitting on "/" also handles
+        # two-digit numerators like "12/8" that indexing [0] silently broke.
+        self._beats_per_measure = int(self.time_signature.split("/")[0])
 
         # init the main stream object
         self.s = m2.stream.Stream([m2.tempo.MetronomeMark(number=self.tempo), 
@@ -88,18 +184,55 @@ class SingerBase(object):
         self.melody = m2.stream.Part([self.instrument_class()])
         self.chords = m2.stream.Part([m2.instrument.Piano()])
 
-        self.num_measures = len(self.chord_progression.split("\n")[:-1])
-        for chord in self.chord_progression.split("\n")[:-1]:
-            c = m2.harmony.ChordSymbol(chord, duration=4)
-            c.volume = m2.volume.Volume(velocity=70)
-            self.chords.append(c)
+        self._chord_lines = self.chord_progression.split("\n")[:-1]
+        self.num_measures = len(self._chord_lines)
+        for chord in self._chord_lines:
+            # shallow copy of the cached template; repeated figures skip
+            # the chord parse entirely.
+            self.chords.append(copy.copy(_chord_symbol_template(chord)))
+        # elements snapshot, so sing() implementations index a plain tuple
+        # instead of going through the Stream's element machinery each time.
+        # same layout as self.chords.elements: [0] is the Piano instrument.
+        self._chord_objs = tuple(self.chords.elements)
 
         self.s.append(self.melody)
         if self.with_chords:
             self.s.append(self.chords)
 
         # all the possible pitches within the sound range and in the key.
-        self.possible_pitches = self.s.keySignature.getScale().getPitches(self.inst_settings["sound_range_low"], self.inst_settings["sound_range_high"])
+        # instance-local list copy, since helpers may filter it in place.
+        self.possible_pitches = list(_scale_pitches(self.key,
+                                                    self.inst_settings["sound_range_low"],
+                                                    self.inst_settings["sound_range_high"]))
+        # MIDI numbers of possible_pitches, for vectorized interval math.
+        self.possible_midi = np.array([p.midi for p in self.possible_pitches], dtype=np.int16)
+        # one Note template per scale pitch, keyed by MIDI number. emitting
+        # a note is then a shallow copy instead of a pitch-name parse; the
+        # copy needs its own Volume since the template's would be shared.
+        self._note_templates = {int(p.midi): m2.note.Note(p.nameWithOctave) for p in self.possible_pitches}
+
+        # singable pitches per chord, computed once instead of on every sing() call.
+        # chord tones are stored as 12-bit pitch-class masks, so membership is a
+        # vectorized shift+and on integers instead of string comparison.
+        # each entry of _singable_by_chord_idx is an index array into
+        # possible_pitches/possible_midi, with the matching nameWithOctave
+        # strings kept for Note construction.
+        # progressions repeat the same few chords, so the lookups are built
+        # once per unique pitch-class mask and shared between repeats.
+        self._possible_pc = np.array([p.pitchClass for p in self.possible_pitches], dtype=np.uint8)
+        self._chord_pc_mask = np.array([functools.reduce(lambda m, pt: m | (1 << pt.pitchClass), c.pitches, 0)
+                                        for c in self._chord_objs[1:]], dtype=np.uint16)
+        idx_by_mask = {}
+        names_by_mask = {}
+        for mask in np.unique(self._chord_pc_mask):
+            # shift the uint16 scalar, not a Python int: under NumPy >= 2
+            # a Python int operand is forced into the uint8 array's dtype
+            # and overflows for masks with a pitch class above 7.
+            idx = np.flatnonzero((mask >> self._possible_pc) & 1)
+            idx_by_mask[int(mask)] = idx
+            names_by_mask[int(mask)] = [self.possible_pitches[i].nameWithOctave for i in idx]
+        self._singable_by_chord_idx = [idx_by_mask[int(mask)] for mask in self._chord_pc_mask]
+        self._singable_names_by_chord = [names_by_mask[int(mask)] for mask in self._chord_pc_mask]
 
     @tempo.validator
     def check_tempo(self, attribute, value):
@@ -113,17 +246,18 @@ class SingerBase(object):
 
     @pattern_progression.validator
     def check_pp(self, attribute, value):
+        # optional attribute: skip the checks entirely when unused.
+        if not value:
+            return
         if len(value) != 4:
             raise ValueError(f"Invalid pattern progression length: {len(value)}")
-        if value[0] < 0 or value[1] < 0 or value[2] < 0 or value[3] < 0 or \
-           value[1] < value[0] or value[2] < value[1] or value[2] < value[0] or \
-           value[3] < value[2] or value[3] < value[1] or value[3] < value[0]:
+        if any(v < 0 for v in value) or \
+           any(a > b for a, b in zip(value, value[1:])):
            raise ValueError(f"Invalid pattern progression value: {value}")
 
-        num_chords = len(self.chord_progression.split("\n"))-1
-        if value[0] > num_chords or value[1] > num_chords or \
-           value[2] > num_chords or value[3] > num_chords:
-           raise ValueError(f"Invalid pattern progression, \must be smaller than chord progression : {value}")
+        num_chords = self.chord_progression.count("\n")
+        if any(v > num_chords for v in value):
+           raise ValueError(f"Invalid pattern progression, must be smaller than chord progression : {value}")
 
 
     #
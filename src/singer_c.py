@@ -6,10 +6,11 @@ import os
 import attr
 import json
 import copy
+import functools
 import numpy as np
 import music21 as m2
 
-from singer_base import SingerBase, MusicTheoryError
+from singer_base import SingerBase, MusicTheoryError, _generate_steps
 
 @attr.s()
 class SingerC(SingerBase):
@@ -25,10 +26,10 @@ class SingerC(SingerBase):
     motif_length : int
         The number of measure(s) of the motif.
     prob_factor : float
-        Parameter of SingerB._interval_reversed_p().
+        Parameter of the interval weighting in singer_base._generate_steps().
         the index of reverse probability. if bigger, the closer note will have higher probability.
     prob_offset : float
-        Parameter of SingerB._interval_reversed_p().
+        Parameter of the interval weighting in singer_base._generate_steps().
         offset when calculating inversed probability.
     """
     continue_develop = attr.ib(type=bool, default=True)
@@ -36,74 +37,101 @@ class SingerC(SingerBase):
     prob_factor = attr.ib(type=float, default=2)
     prob_offset = attr.ib(type=float, default=5)
 
+    @prob_offset.validator
+    def check_prob_offset(self, attribute, value):
+        if value <= 0:
+            raise ValueError(f"Invalid prob_offset: {value}, must be positive.")
+
+    def __attrs_post_init__(self):
+        super().__attrs_post_init__()
+        # the key's 1/3/5 pitches are fixed for the whole song; mode 3 of
+        # _modify_motif used to recompute them for every modified note.
+        self._135_pitches = self.s.keySignature.getScale().pitchesFromScaleDegrees(
+            [1, 3, 5], self.inst_settings["sound_range_low"], self.inst_settings["sound_range_high"])
+
     # override SingerBase.sing()
     def sing(self):
         """
         """
-        # Intro: append one rest note
-        rest_quarter_length = (self.pattern_progression[0] - 1) * int(self.time_signature[0])
-        self.melody.append(m2.note.Rest(quarterLength=rest_quarter_length))
-
-        # Main1: generate a motif, append motif, then generate modifications until beginnig of Main2
-        chord_index = (self.pattern_progression[0] - 1) + (self.motif_length) - 1
-        motif = self._generate_motif()
-        self.melody.append(motif.elements)
-        while chord_index + self.motif_length < self.pattern_progression[1]:
-            variation = self._modify_motif(motif, self.chords.elements[chord_index:chord_index+self.motif_length])
-            self.melody.append(variation.elements)
-            chord_index += self.motif_length
-            if self.continue_develop:
-                motif = variation
-        
-        # Main2: same as main1, generate until outro
-        chord_index = (self.pattern_progression[2] - 1) + (self.motif_length) - 1
-        motif = self._generate_motif()
-        self.melody.append(motif.elements)
-        while chord_index + self.motif_length < self.pattern_progression[3]:
-            variation = self._modify_motif(motif, self.chords.elements[chord_index:chord_index+self.motif_length])
-            self.melody.append(variation.elements)
-            chord_index += self.motif_length
-            if self.continue_develop:
-                motif = variation
-
-    def _generate_motif(self)->m2.stream.Part:
+        # pattern_progression is optional at construction (SingerA/B never
+        # read it), so the singer that does use it has to enforce it here.
+        if not self.pattern_progression:
+            raise ValueError("SingerC requires pattern_progression to sing.")
+        # buffer every section and append to the melody stream in one call,
+        # so music21 only runs its offset bookkeeping once.
+        # Intro: one rest note
+        rest_quarter_length = (self.pattern_progression[0] - 1) * self._beats_per_measure
+        notes_buf = [m2.note.Rest(quarterLength=rest_quarter_length)]
+
+        # Main1 and Main2 are the same generate-then-vary loop over
+        # different measure windows, so drive both from one section list:
+        # generate a motif, append it, then append modifications until the
+        # end of the section.
+        sections = [(self.pattern_progression[0], self.pattern_progression[1]),
+                    (self.pattern_progression[2], self.pattern_progression[3])]
+        for start, end in sections:
+            chord_index = (start - 1) + (self.motif_length) - 1
+            last_midi = next((e.pitch.midi for e in reversed(notes_buf) if isinstance(e, m2.note.Note)), -1)
+            motif = self._generate_motif(last_midi)
+            notes_buf.extend(motif.elements)
+            while chord_index + self.motif_length < end:
+                variation = self._modify_motif(motif, self._chord_objs[chord_index:chord_index+self.motif_length])
+                notes_buf.extend(variation.elements)
+                chord_index += self.motif_length
+                if self.continue_develop:
+                    motif = variation
+
+        self.melody.append(notes_buf)
+
+    def _generate_motif(self, last_midi=-1)->m2.stream.Part:
         """
         Generate a motif with length of self.num_measures
         Basically the same as SingerB.sing().
+
+        Parameters
+        ----------
+        last_midi : int
+            MIDI number of the previous melody note, or -1 if there is
+            none; the first pick is then uniform.
         """
-        motif = m2.stream.Part()
-        self.speed = np.random.choice(self.inst_settings["speed"])
-        for current_chord in self.chords.elements[1:self.motif_length+1]:
-            chord_tones = [pitch.name for pitch in current_chord.pitches]
-            singable_pitches = []
-            for pitch in self.possible_pitches:
-                if pitch.name in chord_tones:
-                    singable_pitches.append(pitch.nameWithOctave)
-
-            if singable_pitches is None:
+        # accumulate plain notes and hand them to the Part constructor in
+        # one go; per-note Stream.append is linear in the stream size.
+        notes_out = []
+        self.speed = self._rng.choice(self._speed_choices)
+        # one shared Duration for the whole motif; notes never mutate it.
+        dur = m2.duration.Duration(4/self.speed)
+        steps_per_measure = (self.speed * self._beats_per_measure) // 4
+        for chord_index, current_chord in enumerate(self._chord_objs[1:self.motif_length+1]):
+            singable_pitches = self._singable_names_by_chord[chord_index]
+            singable_midi = self.possible_midi[self._singable_by_chord_idx[chord_index]]
+
+            # the name lists are built as (possibly empty) lists, never None,
+            # so test emptiness; an empty chord otherwise surfaced later as
+            # an opaque indexing error.
+            if not singable_pitches:
                 raise MusicTheoryError(f"No singable pitches! chord: {current_chord}, key: {self.key}")
 
-            for i in range(int(self.speed * int(self.time_signature[0])/4)):
-                if np.random.rand() < self.inst_settings["rand_trig"]:
+            # all the numeric work for this chord runs in the array kernel;
+            # the loop below only builds music21 objects. same shape as
+            # SingerB.sing().
+            u_trig = self._rng.random(steps_per_measure)
+            u_pick = self._rng.random(steps_per_measure)
+            vol_delta = self._rng.integers(-self._rand_vol, self._rand_vol+1, steps_per_measure)
+            pick_idx = _generate_steps(singable_midi, steps_per_measure,
+                                       self._rand_trig,
+                                       float(self.prob_factor), float(self.prob_offset),
+                                       last_midi, u_trig, u_pick)
+            for i in range(steps_per_measure):
+                if pick_idx[i] < 0:
                     n = m2.note.Rest()
                 else:
-                    if len(self.melody.notes) == 0:
-                        current_pitch = np.random.choice(singable_pitches)
-                    else:
-                        interval_p = self._interval_reversed_p(self.melody.notes[-1].pitch, 
-                                                              singable_pitches,
-                                                              self.prob_factor,
-                                                              self.prob_offset)
-                        try:
-                            current_pitch = np.random.choice(singable_pitches, p=interval_p)
-                        except:
-                            raise MusicTheoryError(f"Random choice failed! Maybe the chord is not in the key. chord: {current_chord}, key: {self.key}")
-                    n = m2.note.Note(current_pitch)
-                    n.volume = m2.volume.Volume(velocity=self.default_volume+int(self.inst_settings["rand_vol"]*(2*np.random.rand()-1)))
-                n.duration = m2.duration.Duration(4/self.speed)
-
-                motif.append(n)
-        return motif
+                    last_midi = int(singable_midi[pick_idx[i]])
+                    n = copy.copy(self._note_templates[last_midi])
+                    n.volume = m2.volume.Volume(velocity=self.default_volume+int(vol_delta[i]))
+                n.duration = dur
+
+                notes_out.append(n)
+        return m2.stream.Part(notes_out)
 
     #TODO
     def _modify_motif(self, original_motif, chord_progression):
@@ -121,7 +149,12 @@ class SingerC(SingerBase):
         original_motif : music21.stream.Part
         chord_progression : list of music21.harmony.ChordSymbol
         """
-        modified_motif = copy.deepcopy(original_motif)
+        # per-note shallow copies instead of music21's whole-tree deepcopy:
+        # the modifications below only rebind pitches, so the copies can
+        # share Pitch/Duration/Volume objects with the original. distinct
+        # Note objects are still needed because sing() appends every
+        # variation to the melody, and a stream cannot hold an element twice.
+        modified_motif = m2.stream.Part([copy.copy(e) for e in original_motif.elements])
         num_notes = len(modified_motif)
 
         # set prob distribution parameters
@@ -131,16 +164,24 @@ class SingerC(SingerBase):
         offset = 3 * np.random.rand() + 0.1
         # calculate prob distribution list
         notes_prob = self._position_exponential_p(num_notes, base, offset)
-        # roll the dice and decide which notes should be modified
-        notes_to_modify = []
-        for i in range(num_notes):
-            if np.random.rand() < notes_prob[i]:
-                notes_to_modify.append(i)
+        # one vectorized Bernoulli trial decides all the notes to be modified
+        notes_to_modify = np.flatnonzero(self._rng.random(num_notes) < notes_prob)
         # shuffle order
-        np.random.shuffle(notes_to_modify)
+        self._rng.shuffle(notes_to_modify)
+        # chord-tone masks and singable pitch lists for this window, built
+        # once per call instead of per modified note in mode 0. masks are
+        # uint16 scalars: shifting a Python int against the uint8
+        # pitch-class array overflows under NumPy >= 2.
+        chord_masks = [np.uint16(functools.reduce(lambda m, pt: m | (1 << pt.pitchClass), c.pitches, 0))
+                       for c in chord_progression]
+        chord_singable = [[self.possible_pitches[j] for j in np.flatnonzero((mask >> self._possible_pc) & 1)]
+                          for mask in chord_masks]
+        # one draw decides the modification mode for every note.
+        modes = self._rng.integers(0, 4, len(notes_to_modify))
         # modify each note
-        for i in notes_to_modify:
-            target_note = modified_motif.elements[i]
+        elements = modified_motif.elements
+        for k, i in enumerate(notes_to_modify):
+            target_note = elements[i]
             if type(target_note) is m2.note.Rest:
                 continue
             #randomly choose one modification:
@@ -149,79 +190,53 @@ class SingerC(SingerBase):
             #1. change note to a diatonic passing tone
             #2. change note to the same as the next tone
             #3. change note to key's 1, 3 or 5
-            modify_mode = np.random.choice(range(4))
+            modify_mode = modes[k]
             if modify_mode == 0:
                 #0. if the note is not chord tone, change it to a chord tone;
                 #   if it is, change it to a none chord tone but key tone.
-                current_chord = chord_progression[int(i/self.speed)]
-                chord_tones = [pitch.name for pitch in current_chord.pitches]
-                singable_pitches = []
-                for pitch in self.possible_pitches:
-                    if pitch.name in chord_tones:
-                        singable_pitches.append(pitch)
-                if target_note.pitch not in current_chord.pitches:
-                    target_note.pitch = self._nearest_pitch(target_note.pitch, singable_pitches)
+                cidx = int(i/self.speed)
+                chord_mask = chord_masks[cidx]
+                if not (chord_mask >> target_note.pitch.pitchClass) & 1:
+                    # the target is not a chord tone, so it is never in this
+                    # list and _nearest_pitch will not drop entries from it.
+                    target_note.pitch = self._nearest_pitch(target_note.pitch, chord_singable[cidx])
                 else:
                     target_note.pitch = self._nearest_pitch(target_note.pitch, self.possible_pitches)
 
             elif modify_mode == 1:
                 #1. change note to a diatonic passing tone
-                next_note = modified_motif.getElementAfterElement(target_note, [m2.note.Note])
-                prev_note = modified_motif.getElementBeforeOffset(target_note.offset, [m2.note.Note])
+                # neighbours by index: the stream getters scan the whole
+                # stream plus its site contexts on every call.
+                next_note = next((e for e in elements[i+1:] if isinstance(e, m2.note.Note)), None)
+                prev_note = next((e for e in elements[:i][::-1] if isinstance(e, m2.note.Note)), None)
                 if next_note is None or prev_note is None:
                     continue
-                target_pitch = m2.pitch.Pitch((next_note.pitch.midi + prev_note.pitch.midi) / 2)
-                target_pitch = self._nearest_pitch(target_pitch, self.possible_pitches)
-                target_note.pitch = target_pitch
+                # the midpoint is only needed as a MIDI number; building a
+                # Pitch from it would parse and normalize an accidental
+                # for a throwaway value.
+                midpoint_midi = (next_note.pitch.midi + prev_note.pitch.midi) / 2
+                target_note.pitch = self._nearest_pitch_midi(midpoint_midi, self.possible_pitches)
 
             elif modify_mode == 2:
                 #2. change note to the same as the next tone or prev note
-                next_note = modified_motif.getElementAfterElement(target_note, [m2.note.Note])
+                next_note = next((e for e in elements[i+1:] if isinstance(e, m2.note.Note)), None)
                 if next_note is None:
                     continue
                 target_note.pitch = next_note.pitch
 
             elif modify_mode == 3:
                 #3. change note to key's 1, 3 or 5
-                target_note.pitch =self._nearest_pitch(target_note.pitch, self.s.keySignature.getScale().pitchesFromScaleDegrees([1,3,5], self.inst_settings["sound_range_low"], self.inst_settings["sound_range_high"]))
+                target_note.pitch = self._nearest_pitch(target_note.pitch, self._135_pitches)
 
         return modified_motif
 
     #
     # util funcs
     #
-    def _interval_reversed_p(self, target_pitch:m2.interval.Interval, pitch_list: list, prob_factor=2, prob_offset=5)->list:
-        """
-        calculate the interval of the pitch to each element in the pitch list.
-        returns a normalized probability of each note, closer note has higher probability.
-
-        Parameters
-        ----------
-        target_pitch : music21.interval.Interval 
-            the targe pitch to calcualte interval with
-        pitch_list : list of str
-            each string is a pitch name, e.g. "G4"
-        prob_factor : float
-            the index of reverse probability. if bigger, the closer note will have higher probability.
-        prob_offset : float
-            offset when calculating inversed probability.
-
-        Returns
-        -------
-        interval_p : list of float
-            the normalized probability of each note.
-        """
-        interval_to_rf = np.array([np.abs(m2.interval.Interval(target_pitch, m2.pitch.Pitch(p)).semitones) for p in pitch_list])
-        interval_p = 1 / (interval_to_rf + prob_offset)
-        interval_p = interval_p ** prob_factor
-        interval_p = interval_p / np.sum(interval_p)
-        return interval_p
-
-
-    def _position_exponential_p(self, num_notes: int, prob_base: float, prob_offset: float)->list:
+    def _position_exponential_p(self, num_notes: int, prob_base: float, prob_offset: float)->np.ndarray:
         """
         Generates a probability distribution that, later notes have higher probability to be changed.
-        
+
         Parameters
         ----------
         num_notes : int
@@ -230,14 +245,25 @@ class SingerC(SingerBase):
 
         Returns
         -------
-        notes_prob : list of float
+        notes_prob : np.ndarray of float
             the normalized probability. All between 0 and 1.
+            always exactly num_notes elements: _modify_motif compares it
+            element-wise against one random draw per note.
         """
-        notes_prob = np.power(prob_base, (np.arange(1+prob_offset, num_notes+1+prob_offset))/num_notes)
-        ## normalize probability
-        notes_prob = notes_prob / (np.max(notes_prob)+prob_offset)
+        # prob_base**(idx/num_notes) written as exp(idx*k): one log plus a
+        # vectorized exp instead of N float-exponent pow calls.
+        # integer-bounds arange plus the float offset: float bounds can
+        # round to one element too many, and the caller compares this
+        # array element-wise against exactly num_notes draws.
+        k = np.log(prob_base) / num_notes
+        idx = np.arange(1, num_notes+1, dtype=np.float64) + prob_offset
+        notes_prob = np.exp(idx * k)
+        ## normalize probability. the exponential is increasing for
+        ## prob_base > 1 (which _modify_motif guarantees), so the max is
+        ## simply the last element.
+        notes_prob /= (notes_prob[-1]+prob_offset)
 
-        return list(notes_prob)
+        return notes_prob
 
     def _nearest_pitch(self, target_pitch: m2.pitch.Pitch, pitch_list: list)->list:
         """
@@ -257,13 +283,40 @@ class SingerC(SingerBase):
         if len(pitch_list) == 0:
             raise ValueError(f"Pitch List is Empty!")
 
-        # if target_pitch is in pitch_list, remove it
-        for pitch in pitch_list:
-            if pitch.nameWithOctave == target_pitch.nameWithOctave:
-                pitch_list.remove(pitch)
+        # semitone distance is just the MIDI difference, so skip the
+        # per-candidate Interval construction and argmin over an int array.
+        # the target itself is excluded by masking its distance rather than
+        # list.remove: callers pass shared lists (possible_pitches,
+        # _135_pitches) that must not shrink between calls.
+        midis = np.fromiter((p.midi for p in pitch_list), dtype=np.int16, count=len(pitch_list))
+        diffs = np.abs(midis - target_pitch.midi)
+        target_name = target_pitch.nameWithOctave
+        for j, pitch in enumerate(pitch_list):
+            if pitch.nameWithOctave == target_name:
+                diffs[j] = np.iinfo(np.int16).max
+        return pitch_list[int(np.argmin(diffs))]
+
+    def _nearest_pitch_midi(self, target_midi: float, pitch_list: list)->m2.pitch.Pitch:
+        """
+        _nearest_pitch for a bare MIDI number, e.g. the passing-tone
+        midpoint. Skips the Pitch construction and the equal-pitch
+        exclusion, which a fractional midpoint never triggers.
+
+        Parameters
+        ----------
+        target_midi : float
+        pitch_list : list of music21.pitch.Pitch
+            pitch with octave
+
+        Returns
+        -------
+        nearest_pitch : music21.pitch.Pitch
+        """
+        if len(pitch_list) == 0:
+            raise ValueError(f"Pitch List is Empty!")
 
-        interval_to_rf = np.array([np.abs(m2.interval.Interval(target_pitch, pit).semitones) for pit in pitch_list])
-        return pitch_list[np.argmin(interval_to_rf)]
+        midis = np.fromiter((p.midi for p in pitch_list), dtype=np.int16, count=len(pitch_list))
+        return pitch_list[int(np.argmin(np.abs(midis - target_midi)))]
 
 
 if __name__ == "__main__":
@@ -4,7 +4,8 @@ Author: Arthur Jinyue Guo jg5505@nyu.edu
 """
 import os
 import attr
-import json
+
+from utils import load_json
 
 @attr.s(kw_only=True)
 class Song(object):
@@ -38,28 +39,30 @@ class Song(object):
     def check_pp(self, attribute, value):
         if len(value) != 4:
             raise ValueError(f"Invalid pattern progression length: {len(value)}")
-        if value[0] < 0 or value[1] < 0 or value[2] < 0 or value[3] < 0 or \
-           value[1] < value[0] or value[2] < value[1] or value[2] < value[0] or \
-           value[3] < value[2] or value[3] < value[1] or value[3] < value[0]:
+        if any(v < 0 for v in value) or \
+           any(a > b for a, b in zip(value, value[1:])):
            raise ValueError(f"Invalid pattern progression value: {value}")
 
-        num_chords = len(self.chord_progression.split("\n"))-1
-        if value[0] > num_chords or value[1] > num_chords or value[2] > num_chords or value[3] > num_chords:
+        # counting separators avoids allocating the split list just for its length.
+        num_chords = self.chord_progression.count("\n")
+        if any(v > num_chords for v in value):
            raise ValueError(f"Invalid pattern progression, must be smaller than chord progression : {value}")
 
     def __attrs_post_init__(self):
         self.genre = self.genre.lower()
         # load style config file
-        with open(self.style_path, "r") as f:
-            f_json = json.load(f)
-            supported_styles = f_json["supported_styles"]
-            styles = f_json["styles"]
+        f_json = load_json(self.style_path)
+        supported_styles = f_json["supported_styles"]
+        styles = f_json["styles"]
 
         if self.genre not in supported_styles:
             raise ValueError(f"Unsupported song style: {value}")
 
         self.groove = styles[self.genre]
 
+        # chord lines parsed once; build_mma may run several times.
+        self._chord_lines = self.chord_progression.split("\n")[:-1]
+
 
     #
     # class methods
@@ -81,7 +84,7 @@ class Song(object):
         mma_string += f"Tempo {self.tempo}\n"
         mma_string += "\nGroove {}\n\n".format(self.groove["Intro"])
 
-        for bar_index, chord in enumerate(self.chord_progression.split("\n")[:-1]):
+        for bar_index, chord in enumerate(self._chord_lines):
             if self.pattern_progression[0] == bar_index + 1:
                 mma_string += "\nGroove {}\n\n".format(self.groove["Main1"])
             elif self.pattern_progression[1] == bar_index + 1:
@@ -0,0 +1,23 @@
+"""
+Shared helpers for the Jammer modules.
+
+Author: Arthur Jinyue Guo jg5505@nyu.edu
+"""
+import os
+import json
+import functools
+
+
+@functools.lru_cache(maxsize=8)
+def _load_json_mtime(path, mtime):
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def load_json(path):
+    """
+    Load a JSON config file, cached on (path, mtime) so constructing many
+    Singer/Song/Producer objects does not re-read and re-parse the same file.
+    The mtime key invalidates the cache if the file changes during a session.
+    """
+    return _load_json_mtime(path, os.path.getmtime(path))